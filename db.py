@@ -73,7 +73,24 @@ class Database:
         ensure_column("messages", "delivered", "INTEGER")
         ensure_column("messages", "reply_to", "INTEGER")
 
+        # (user, id) — выборка по пользователю сразу в порядке id, без сортировки
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_from_id ON messages (from_user, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_to_id ON messages (to_user, id)")
+
         ensure_column("support", "created_at", "TEXT")
+        ensure_column("support", "status", "TEXT DEFAULT 'open'")
+        ensure_column("support", "assignee", "INTEGER")
+        ensure_column("support", "notified", "INTEGER DEFAULT 0")
+        ensure_column("support", "answered_at", "TEXT")
+
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_support_status ON support (status, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_support_notified ON support (notified, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_support_user ON support (user_id, id)")
+
+        # bans — единственный источник правды о банах; until = NULL — бессрочно
+        ensure_column("bans", "until", "TEXT")
+        ensure_column("bans", "created_at", "TEXT")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_bans_until ON bans (until) WHERE until IS NOT NULL")
 
         self.conn.commit()
         print("[DB] Migration complete — DB is up to date!")
@@ -96,17 +113,126 @@ class Database:
 
     def is_user_banned(self, user_id):
         cur = self.conn.cursor()
-        cur.execute("SELECT 1 FROM bans WHERE user_id = ?", (user_id,))
+        cur.execute(
+            "SELECT 1 FROM bans WHERE user_id = ? AND (until IS NULL OR until > ?)",
+            (user_id, datetime.now().isoformat())
+        )
         return cur.fetchone() is not None
 
-    def ban_user(self, user_id):
+    def ban_user(self, user_id, until=None):
+        return self.ban_users([user_id], until)
+
+    def unban_user(self, user_id):
+        return self.unban_users([user_id])
+
+    def ban_users(self, user_ids, until=None):
+        # весь список одной транзакцией; повторный бан срок только продлевает:
+        # бессрочный остаётся бессрочным, временный — до более поздней даты
+        now = datetime.now().isoformat()
+        until = until.isoformat() if until else None
+        rows = [(uid, until, now) for uid in dict.fromkeys(user_ids)]
         cur = self.conn.cursor()
-        cur.execute("INSERT OR IGNORE INTO bans (user_id) VALUES (?)", (user_id,))
+        cur.executemany("""
+            INSERT INTO bans (user_id, until, created_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET until = CASE
+                WHEN bans.until IS NULL OR excluded.until IS NULL THEN NULL
+                ELSE MAX(bans.until, excluded.until)
+            END
+        """, rows)
         self.conn.commit()
+        return len(rows)
 
-    def unban_user(self, user_id):
+    def unban_users(self, user_ids):
+        cur = self.conn.cursor()
+        cur.executemany("DELETE FROM bans WHERE user_id = ?", [(uid,) for uid in dict.fromkeys(user_ids)])
+        self.conn.commit()
+        return cur.rowcount
+
+    def expire_bans(self):
         cur = self.conn.cursor()
-        cur.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
+        cur.execute(
+            "DELETE FROM bans WHERE until IS NOT NULL AND until <= ?",
+            (datetime.now().isoformat(),)
+        )
+        self.conn.commit()
+        return cur.rowcount
+
+    def get_broadcast_recipients(self):
+        # anti-join по первичному ключу bans
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT u.user_id FROM users u
+            LEFT JOIN bans b ON b.user_id = u.user_id
+            WHERE b.user_id IS NULL OR (b.until IS NOT NULL AND b.until <= ?)
+        """, (datetime.now().isoformat(),))
+        return [r["user_id"] for r in cur.fetchall()]
+
+    # ----------------------------------------------------------------------
+    # SUPPORT (очередь обращений)
+    # ----------------------------------------------------------------------
+
+    def create_support_ticket(self, user_id, message):
+        cur = self.conn.cursor()
+        cur.execute(
+            "INSERT INTO support (user_id, message, created_at, status, notified) VALUES (?, ?, ?, 'open', 0)",
+            (user_id, message, datetime.now().isoformat())
+        )
+        self.conn.commit()
+        return cur.lastrowid
+
+    def get_support_ticket(self, ticket_id):
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM support WHERE id = ?", (ticket_id,))
+        return cur.fetchone()
+
+    def get_support_tickets(self, status="open", limit=10, offset=0):
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT * FROM support WHERE status = ? ORDER BY id ASC LIMIT ? OFFSET ?",
+            (status, limit, offset)
+        )
+        return cur.fetchall()
+
+    def count_support_tickets(self, status="open"):
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM support WHERE status = ?", (status,))
+        return cur.fetchone()[0]
+
+    def assign_support_ticket(self, ticket_id, assignee):
+        cur = self.conn.cursor()
+        cur.execute("UPDATE support SET assignee = ? WHERE id = ?", (assignee, ticket_id))
+        self.conn.commit()
+
+    def set_support_status(self, ticket_id, status):
+        cur = self.conn.cursor()
+        answered_at = datetime.now().isoformat() if status == "answered" else None
+        cur.execute(
+            "UPDATE support SET status = ?, answered_at = COALESCE(?, answered_at) WHERE id = ?",
+            (status, answered_at, ticket_id)
+        )
+        self.conn.commit()
+
+    def get_last_support_time(self, user_id):
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT created_at FROM support WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        )
+        row = cur.fetchone()
+        return row["created_at"] if row else None
+
+    def get_unnotified_support_tickets(self, limit=20):
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT * FROM support WHERE notified = 0 AND status = 'open' ORDER BY id ASC LIMIT ?",
+            (limit,)
+        )
+        return cur.fetchall()
+
+    def mark_support_notified(self, max_id):
+        # одна UPDATE на весь дайджест, а не по тикету
+        cur = self.conn.cursor()
+        cur.execute("UPDATE support SET notified = 1 WHERE notified = 0 AND id <= ?", (max_id,))
         self.conn.commit()
 
     # ----------------------------------------------------------------------
@@ -144,3 +270,29 @@ class Database:
         cur = self.conn.cursor()
         cur.execute("SELECT * FROM messages WHERE to_user = ? ORDER BY id DESC", (user_id,))
         return cur.fetchall()
+
+    def iter_messages_by_user(self, user_id, sent=True):
+        # курсор отдаётся как есть — строки идут по индексу (user, id) по мере обхода;
+        # отправленные и полученные — два отдельных прохода, чтобы не было OR и сортировки
+        column = "from_user" if sent else "to_user"
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            SELECT id, from_user, to_user, text, created_at, reply_to FROM messages
+            WHERE {column} = ?
+            ORDER BY id DESC
+        """, (user_id,))
+        return cur
+
+    def get_counterpart_totals(self, user_id):
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT CASE WHEN from_user = ? THEN to_user ELSE from_user END AS counterpart,
+                   SUM(from_user = ?) AS sent,
+                   SUM(to_user = ?) AS received,
+                   COUNT(*) AS total
+            FROM messages
+            WHERE from_user = ? OR to_user = ?
+            GROUP BY counterpart
+            ORDER BY total DESC
+        """, (user_id,) * 5)
+        return cur
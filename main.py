@@ -1,9 +1,12 @@
+import asyncio
 import logging
+import re
 import sqlite3
 import os
 import sys
+import tempfile
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import quote
 from pathlib import Path
 
@@ -29,6 +32,9 @@ from telegram.ext import (
 from db import Database
 db = Database()
 
+from spam_filter import SpamFilter, REASON_BANNED, REASON_DUPLICATE, REASON_FLOOD
+spam_filter = SpamFilter()
+
 # ----------------- ENV -----------------
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
@@ -53,6 +59,14 @@ logger = logging.getLogger(__name__)
 # --------------- Config ---------------
 MAX_MSG_LENGTH = 2000
 RATE_LIMIT_SECONDS = 3
+SUPPORT_PAGE_SIZE = 5
+SUPPORT_DIGEST_SECONDS = int(os.getenv("SUPPORT_DIGEST_SECONDS", "60"))
+SUPPORT_DIGEST_LIMIT = 20
+SUPPORT_COOLDOWN_SECONDS = 60
+BAN_SWEEP_SECONDS = 60
+BAN_FILE_MAX_BYTES = 1024 * 1024
+LOOKUP_SUMMARY_TOP = 20
+CAPTION_MAX_LENGTH = 1024
 
 
 # ----------------- UI helpers -----------------
@@ -81,9 +95,11 @@ def admin_menu():
         [
             InlineKeyboardButton("🔍 Поиск по ID", callback_data="admin_lookup"),
             InlineKeyboardButton("⛔ Бан", callback_data="admin_ban"),
+            InlineKeyboardButton("✅ Разбан", callback_data="admin_unban"),
         ],
         [
             InlineKeyboardButton("📢 Рассылка", callback_data="admin_broadcast"),
+            InlineKeyboardButton("📮 Обращения", callback_data="admin_support"),
         ],
         [
             InlineKeyboardButton("📊 Статистика", callback_data="admin_stats"),
@@ -127,6 +143,220 @@ def update_rate_limit(user_id: int, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 
+SPAM_REPLIES = {
+    REASON_BANNED: "⛔ Сообщение содержит запрещённые фразы и не отправлено.",
+    REASON_DUPLICATE: "⛔ Похожее сообщение уже было отправлено недавно.",
+    REASON_FLOOD: "⏳ Получатель сейчас получает слишком много сообщений, попробуйте позже.",
+}
+
+
+# ----------------- Bans -----------------
+BAN_DURATION_RE = re.compile(r"(\d+)([mhd])", re.ASCII)
+BAN_DURATION_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+BAN_MAX_DURATION = timedelta(days=3650)
+BAN_ID_RE = re.compile(r"-?\d+", re.ASCII)
+SQLITE_INT_MIN, SQLITE_INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def parse_ban_input(text: str, allow_duration: bool = True):
+    """Список id (через пробел, запятую или с новой строки) и необязательный срок: 30m / 12h / 7d.
+
+    Возвращает (ids, until, bad) — bad содержит все отклонённые токены, исключений нет.
+    """
+    ids, until, bad = [], None, []
+    for token in re.split(r"[\s,;]+", text.strip()):
+        if not token:
+            continue
+        if BAN_ID_RE.fullmatch(token):
+            uid = int(token)
+            if SQLITE_INT_MIN <= uid <= SQLITE_INT_MAX:
+                ids.append(uid)
+            else:
+                bad.append(token)
+            continue
+        m = BAN_DURATION_RE.fullmatch(token.lower())
+        if m and allow_duration:
+            try:
+                duration = timedelta(**{BAN_DURATION_UNITS[m.group(2)]: int(m.group(1))})
+            except OverflowError:
+                duration = None
+            if duration and duration <= BAN_MAX_DURATION:
+                until = datetime.now() + duration
+                continue
+        bad.append(token)
+    return ids, until, bad
+
+
+async def apply_ban_input(message, text: str, ban: bool):
+    ids, until, bad = parse_ban_input(text, allow_duration=ban)
+    if bad:
+        shown = ", ".join(bad[:10]) + (f" … (+{len(bad) - 10})" if len(bad) > 10 else "")
+        await message.reply_text(
+            f"❗ Не распознано: {shown}\nНичего не изменено. Срок указывается как 30m, 12h или 7d (больше нуля, не больше 3650d).",
+            reply_markup=admin_menu()
+        )
+        return
+
+    note = ""
+    if ban and ADMIN_ID in ids:
+        ids = [uid for uid in ids if uid != ADMIN_ID]
+        note = f"\nID администратора ({ADMIN_ID}) пропущен."
+    if not ids:
+        await message.reply_text("Не найдено ни одного ID." + note, reply_markup=admin_menu())
+        return
+    if ban:
+        count = db.ban_users(ids, until)
+        suffix = f" до {until:%Y-%m-%d %H:%M}" if until else ""
+        await message.reply_text(f"⛔ Забанено: {count}{suffix}.{note}", reply_markup=admin_menu())
+    else:
+        count = db.unban_users(ids)
+        await message.reply_text(f"✅ Разбанено: {count}.", reply_markup=admin_menu())
+
+
+async def ban_sweep_loop():
+    while True:
+        await asyncio.sleep(BAN_SWEEP_SECONDS)
+        try:
+            expired = db.expire_bans()
+            if expired:
+                logger.info("Expired bans removed: %s", expired)
+        except Exception:
+            logger.exception("Ban sweep error")
+
+
+# ----------------- Admin lookup report -----------------
+def lookup_summary(report_db: Database, uid: int):
+    """Сводка по собеседникам — один GROUP BY; храним только первые LOOKUP_SUMMARY_TOP строк."""
+    top, counterparts, sent, received = [], 0, 0, 0
+    for r in report_db.get_counterpart_totals(uid):
+        counterparts += 1
+        sent += r["sent"]
+        received += r["received"]
+        if len(top) < LOOKUP_SUMMARY_TOP:
+            top.append(f"{r['counterpart']}: ↑{r['sent']} ↓{r['received']}")
+    if not counterparts:
+        return None
+
+    header = f"🔍 {uid}: отправлено {sent}, получено {received}, собеседников {counterparts}\n"
+    # подпись к документу — не длиннее CAPTION_MAX_LENGTH, запас оставляем под «и ещё N»
+    lines = []
+    length = len(header)
+    for line in top:
+        if length + len(line) + 1 > CAPTION_MAX_LENGTH - 32:
+            break
+        lines.append(line)
+        length += len(line) + 1
+    summary = header + "\n" + "\n".join(lines)
+    if counterparts > len(lines):
+        summary += f"\n… и ещё {counterparts - len(lines)}"
+    return summary
+
+
+def write_lookup_report(report_db: Database, fh, uid: int):
+    """Пишет историю пользователя в файл построчно прямо из курсора."""
+    fh.write(f"Сообщения пользователя {uid} (новые сверху)\n")
+    for title, sent in (("отправленные", True), ("полученные", False)):
+        fh.write(f"\n===== {title} =====\n\n")
+        for r in report_db.iter_messages_by_user(uid, sent=sent):
+            reply = f" (ответ на #{r['reply_to']})" if r["reply_to"] else ""
+            fh.write(f"#{r['id']} {r['from_user']} → {r['to_user']} | {r['created_at']}{reply}\n")
+            fh.write(f"{r['text'] or ''}\n\n")
+
+
+def build_lookup_report(fh, uid: int):
+    # выполняется в отдельном потоке — со своим соединением, чтобы не делить db.conn с циклом
+    report_db = Database()
+    try:
+        summary = lookup_summary(report_db, uid)
+        if summary:
+            write_lookup_report(report_db, fh, uid)
+            fh.flush()
+            fh.seek(0)
+        return summary
+    finally:
+        report_db.conn.close()
+
+
+async def send_lookup_report(message, uid: int):
+    with tempfile.NamedTemporaryFile("w+", encoding="utf-8", suffix=".txt") as fh:
+        summary = await asyncio.to_thread(build_lookup_report, fh, uid)
+        if not summary:
+            await message.reply_text("Нет сообщений для этого ID.", reply_markup=admin_menu())
+            return
+        # сводка идёт подписью к документу — один вызов Bot API
+        await message.reply_document(
+            document=fh.buffer,
+            filename=f"lookup_{uid}.txt",
+            caption=summary,
+            reply_markup=admin_menu()
+        )
+
+
+# ----------------- Support queue -----------------
+def is_support_rate_limited(user_id: int) -> bool:
+    last = db.get_last_support_time(user_id)
+    if not last:
+        return False
+    try:
+        return (time.time() - datetime.fromisoformat(last).timestamp()) < SUPPORT_COOLDOWN_SECONDS
+    except Exception:
+        return False
+
+
+def support_ticket_keyboard(ticket_id: int):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Ответить", callback_data=f"support_reply_{ticket_id}"),
+        InlineKeyboardButton("Закрыть", callback_data=f"support_close_{ticket_id}"),
+    ]])
+
+
+async def send_support_page(message, offset: int = 0):
+    rows = db.get_support_tickets("open", limit=SUPPORT_PAGE_SIZE, offset=offset)
+    total = db.count_support_tickets("open")
+    if not rows:
+        await message.reply_text("📭 Открытых обращений нет.", reply_markup=admin_menu())
+        return
+
+    await message.reply_text(f"📮 Открытые обращения ({offset + 1}–{offset + len(rows)} из {total}):")
+    for t in rows:
+        assignee = f" | взял: {t['assignee']}" if t["assignee"] else ""
+        await message.reply_text(
+            f"#{t['id']} от {t['user_id']} ({t['created_at']}){assignee}\n\n{(t['message'] or '')[:1000]}",
+            reply_markup=support_ticket_keyboard(t["id"])
+        )
+    next_offset = offset + SUPPORT_PAGE_SIZE
+    if next_offset < total:
+        await message.reply_text(
+            "Показать следующие:",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Ещё", callback_data=f"admin_support_{next_offset}")]])
+        )
+
+
+async def send_support_digest(bot):
+    # одно уведомление админу на пачку новых обращений вместо пуша на каждое
+    rows = db.get_unnotified_support_tickets(limit=SUPPORT_DIGEST_LIMIT)
+    if not rows:
+        return
+    lines = [f"#{t['id']} от {t['user_id']}: {(t['message'] or '')[:80]}" for t in rows]
+    await bot.send_message(
+        ADMIN_ID,
+        f"🆘 Новые обращения в поддержку: {len(rows)}\n"
+        f"Всего открытых: {db.count_support_tickets('open')}\n\n" + "\n".join(lines),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📮 Открыть очередь", callback_data="admin_support")]])
+    )
+    db.mark_support_notified(rows[-1]["id"])
+
+
+async def support_digest_loop(bot):
+    while True:
+        await asyncio.sleep(SUPPORT_DIGEST_SECONDS)
+        try:
+            await send_support_digest(bot)
+        except Exception:
+            # тикеты остаются notified=0 и попадут в следующий дайджест
+            logger.exception("Support digest error")
+
+
 # ----------------- /start -----------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -169,12 +399,30 @@ async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     data = query.data
     user = query.from_user
-# ---- админ отвечает пользователю ----
-    if data.startswith("support_reply_"):
-       target = int(data.split("_")[2])
-       context.user_data["reply_support"] = target
-       await query.message.reply_text(f"✏ Напишите ответ пользователю {target}:")
-       return
+# ---- админ отвечает на обращение ----
+    if data.startswith("support_reply_") or data.startswith("support_close_"):
+        if user.id != ADMIN_ID:
+            await query.message.reply_text("❌ Нет доступа.")
+            return
+        try:
+            ticket_id = int(data.split("_")[2])
+        except (IndexError, ValueError):
+            await query.message.reply_text("Неверный ID обращения.")
+            return
+        ticket = db.get_support_ticket(ticket_id)
+        if not ticket:
+            await query.message.reply_text("Обращение не найдено.")
+            return
+
+        if data.startswith("support_close_"):
+            db.set_support_status(ticket_id, "closed")
+            await query.message.reply_text(f"✔ Обращение #{ticket_id} закрыто.")
+            return
+
+        db.assign_support_ticket(ticket_id, user.id)
+        context.user_data["reply_support"] = ticket_id
+        await query.message.reply_text(f"✏ Напишите ответ на обращение #{ticket_id} (пользователь {ticket['user_id']}):")
+        return
 # ====== Поддержка ======
     if data == "support":
       context.user_data["support_waiting"] = True
@@ -334,6 +582,16 @@ async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text(txt)
             return
 
+        # support queue (admin_support / admin_support_<offset>)
+        if cmd == "support" or cmd.startswith("support_"):
+            conn.close()
+            try:
+                offset = int(cmd.split("_")[1]) if "_" in cmd else 0
+            except ValueError:
+                offset = 0
+            await send_support_page(query.message, offset)
+            return
+
         # lookup by id (start interactive)
         if cmd == "lookup":
             context.user_data["admin_waiting_lookup"] = True
@@ -341,10 +599,16 @@ async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             conn.close()
             return
 
-        # ban interactive
-        if cmd == "ban":
-            context.user_data["admin_waiting_ban"] = True
-            await query.message.reply_text("Введите user_id для бана:", reply_markup=admin_menu())
+        # ban / unban interactive
+        if cmd in ("ban", "unban"):
+            # один режим на раз: повторное нажатие Бан/Разбан перезаписывает предыдущий
+            context.user_data["admin_ban_mode"] = cmd
+            action = "бана" if cmd == "ban" else "разбана"
+            hint = "\nДля временного бана добавьте срок: 30m, 12h или 7d." if cmd == "ban" else ""
+            await query.message.reply_text(
+                f"Введите user_id для {action} (можно списком) или пришлите .txt файл с ID.{hint}",
+                reply_markup=admin_menu()
+            )
             conn.close()
             return
 
@@ -403,32 +667,44 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("support_waiting"):
         context.user_data.pop("support_waiting")
 
-        admin_id = ADMIN_ID
+        # тикеты копятся в таблице и дайджестах — те же ограничения, что и для сообщений
+        if db.is_user_banned(user.id):
+            await update.message.reply_text("⛔ Вы заблокированы и не можете писать в поддержку.")
+            return
+        if len(text) > MAX_MSG_LENGTH:
+            await update.message.reply_text(f"❗ Обращение слишком длинное (максимум {MAX_MSG_LENGTH}).", reply_markup=user_menu())
+            return
+        if is_support_rate_limited(user.id):
+            await update.message.reply_text("⏳ Обращение уже отправлено недавно, подождите минуту.", reply_markup=user_menu())
+            return
 
-        await context.bot.send_message(
-            admin_id,
-            f"🆘 Новое обращение в поддержку\n"
-            f"От пользователя: {user.id}\n\n"
-            f"Текст:\n{text}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Ответить", callback_data=f"support_reply_{user.id}")]
-            ])
-        )
+        # обращение сохраняется в очередь, админ получит его в дайджесте
+        ticket_id = db.create_support_ticket(user.id, text)
 
-        await update.message.reply_text("✔ Ваше сообщение отправлено в поддержку!")
+        await update.message.reply_text(f"✔ Ваше обращение #{ticket_id} принято в поддержку!")
         return
 
 
     # --- админ отправляет ответ ---
-    if context.user_data.get("reply_support"):
-        target = context.user_data.pop("reply_support")
+    if context.user_data.get("reply_support") and user.id == ADMIN_ID:
+        ticket_id = context.user_data.pop("reply_support")
+        ticket = db.get_support_ticket(ticket_id)
+        if not ticket:
+            await update.message.reply_text("Обращение не найдено.", reply_markup=admin_menu())
+            return
 
-        await context.bot.send_message(
-            target,
-            f"📮 Ответ поддержки:\n\n{text}"
-        )
+        try:
+            await context.bot.send_message(
+                ticket["user_id"],
+                f"📮 Ответ поддержки на обращение #{ticket_id}:\n\n{text}"
+            )
+        except Exception as e:
+            logger.exception("Failed to send support reply: %s", e)
+            await update.message.reply_text(f"⚠ Не удалось доставить ответ на #{ticket_id}.", reply_markup=admin_menu())
+            return
 
-        await update.message.reply_text("✔ Ответ отправлен пользователю.")
+        db.set_support_status(ticket_id, "answered")
+        await update.message.reply_text(f"✔ Ответ на обращение #{ticket_id} отправлен.")
         return
 
     # ensure user exists
@@ -450,37 +726,24 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             await update.message.reply_text("Некорректный ID.", reply_markup=admin_menu())
             return
-        rows = db.get_messages_by_user(uid, limit=200)
-        if not rows:
-            await update.message.reply_text("Нет сообщений для этого ID.", reply_markup=admin_menu())
-            return
-        out = "Последние сообщения:\n\n" + "\n".join(f"#{r[0]} {r[1]} → {r[2]} | {(r[3] or '')[:80]} | {r[4]}" for r in rows)
-        for chunk in [out[i:i+4000] for i in range(0, len(out), 4000)]:
-            await update.message.reply_text(chunk)
-        await update.message.reply_text("Готово.", reply_markup=admin_menu())
+        try:
+            await send_lookup_report(update.message, uid)
+        except Exception as e:
+            logger.exception("Lookup report error: %s", e)
+            await update.message.reply_text("⚠ Не удалось сформировать отчёт.", reply_markup=admin_menu())
         return
 
-    # admin interactive: ban
-    if context.user_data.get("admin_waiting_ban") and user.id == ADMIN_ID and not text.startswith("/"):
-        context.user_data.pop("admin_waiting_ban")
-        try:
-            uid = int(text.strip())
-        except:
-            await update.message.reply_text("Некорректный ID.", reply_markup=admin_menu())
-            return
-        db.set_user_banned(uid, 1)
-        await update.message.reply_text(f"Пользователь {uid} забанен.", reply_markup=admin_menu())
+    # admin interactive: ban / unban
+    if context.user_data.get("admin_ban_mode") and user.id == ADMIN_ID and not text.startswith("/"):
+        mode = context.user_data.pop("admin_ban_mode")
+        await apply_ban_input(update.message, text, ban=(mode == "ban"))
         return
 
     # admin interactive: broadcast
     if context.user_data.get("admin_waiting_broadcast") and user.id == ADMIN_ID and not text.startswith("/"):
         context.user_data.pop("admin_waiting_broadcast")
         broadcast_text = text.strip()
-        conn = sqlite3.connect(db.DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT user_id FROM users WHERE banned IS NULL OR banned=0")
-        users = [u[0] for u in cur.fetchall()]
-        conn.close()
+        users = db.get_broadcast_recipients()
         count = 0
         for uid in users:
             try:
@@ -516,6 +779,12 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⏳ Подождите пару секунд перед следующим сообщением.", reply_markup=user_menu())
             return
 
+        reason = spam_filter.check(user.id, target, text)
+        if reason:
+            logger.info("Spam filter (%s): %s -> %s", reason, user.id, target)
+            await update.message.reply_text(SPAM_REPLIES[reason], reply_markup=user_menu())
+            return
+
         # save with reply_to = reply_mid
         msg_id = db.save_message(
     from_user=user.id,
@@ -546,6 +815,12 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⏳ Подождите пару секунд.", reply_markup=user_menu())
             return
 
+        reason = spam_filter.check(user.id, target, text)
+        if reason:
+            logger.info("Spam filter (%s): %s -> %s", reason, user.id, target)
+            await update.message.reply_text(SPAM_REPLIES[reason], reply_markup=user_menu())
+            return
+
         msg_id = db.save_message(user.id, target, text)
         try:
             await context.bot.send_message(target, f"📨 Анонимное сообщение:\n\n{text}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Ответить", callback_data=f"reply_{msg_id}")]]))
@@ -560,6 +835,30 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📌 Выберите действие:", reply_markup=user_menu())
 
 
+# ----------------- DOCUMENT handler (импорт банов из файла) -----------------
+async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user.id != ADMIN_ID:
+        return
+    mode = context.user_data.pop("admin_ban_mode", None)
+    if not mode:
+        return
+    ban = mode == "ban"
+
+    doc = update.message.document
+    if doc.file_size and doc.file_size > BAN_FILE_MAX_BYTES:
+        await update.message.reply_text("Файл слишком большой.", reply_markup=admin_menu())
+        return
+    try:
+        tg_file = await doc.get_file()
+        data = await tg_file.download_as_bytearray()
+    except Exception as e:
+        logger.exception("Ban import download error: %s", e)
+        await update.message.reply_text("⚠ Не удалось скачать файл.", reply_markup=admin_menu())
+        return
+    await apply_ban_input(update.message, data.decode("utf-8-sig", errors="ignore"), ban=ban)
+
+
 # ----------------- error handler -----------------
 async def error_handler(update, context):
     logger.exception("Update caused error", exc_info=context.error)
@@ -578,8 +877,22 @@ def main():
             BotCommand("menu", "Открыть меню"),
             BotCommand("admin", "Открыть админ-панель")
         ])
+        app.bot_data["support_digest_task"] = asyncio.create_task(support_digest_loop(app.bot))
+        app.bot_data["ban_sweep_task"] = asyncio.create_task(ban_sweep_loop())
     app.post_init = _post_init
 
+    async def _post_shutdown(app):
+        # фоновые задачи не переживают остановку polling — отменяем явно
+        for key in ("support_digest_task", "ban_sweep_task"):
+            task = app.bot_data.pop(key, None)
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+    app.post_shutdown = _post_shutdown
+
     # handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("menu", start))
@@ -587,6 +900,7 @@ def main():
 
     app.add_handler(CallbackQueryHandler(callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    app.add_handler(MessageHandler(filters.Document.ALL, document_handler))
 
     app.add_error_handler(error_handler)
 
@@ -0,0 +1,242 @@
+import os
+import time
+from collections import OrderedDict, deque
+
+# ----------------- Config -----------------
+BANNED_PHRASES_FILE = os.getenv("BANNED_PHRASES_FILE", "banned_phrases.txt")
+
+DUPLICATE_SHINGLE = 3           # длина шингла в словах
+DUPLICATE_THRESHOLD = 0.8       # Жаккар, начиная с которого считаем дублем
+DUPLICATE_HISTORY = 10          # сколько последних сообщений помнить на отправителя
+DUPLICATE_MIN_TARGETS = 3       # дубль — спам, только если ушёл стольким разным получателям
+DUPLICATE_WINDOW_SECONDS = 600
+DUPLICATE_MAX_SENDERS = 10000   # размер LRU по отправителям
+
+FLOOD_TARGET_LIMIT = 60         # сообщений одному получателю ...
+FLOOD_SENDER_LIMIT = 5          # ... из них не больше стольких от одного отправителя ...
+FLOOD_TARGET_WINDOW_SECONDS = 60  # ... за это окно
+FLOOD_MAX_TARGETS = 10000
+
+# причины отказа (ключи для сообщений пользователю)
+REASON_BANNED = "banned_phrase"
+REASON_DUPLICATE = "duplicate"
+REASON_FLOOD = "target_flood"
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+# ----------------------------------------------------------------------
+# Aho-Corasick: все запрещённые фразы за один проход по тексту
+# ----------------------------------------------------------------------
+
+class PhraseMatcher:
+    def __init__(self, phrases=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]   # длины фраз, заканчивающихся в узле (с учётом fail-ссылок)
+        for phrase in phrases:
+            phrase = normalize(phrase)
+            if phrase:
+                self._add(phrase)
+        self._build()
+
+    def _add(self, phrase):
+        node = 0
+        for ch in phrase:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = nxt
+        self.out[node] = (len(phrase),)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.fail[nxt] == nxt:
+                    self.fail[nxt] = 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def search(self, text):
+        """Ищет фразы только целыми словами: «хуй» не находится в «страхуй»."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        end = len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node] or (i < end and text[i + 1].isalnum()):
+                continue
+            for length in out[node]:
+                start = i - length + 1
+                if start == 0 or not text[start - 1].isalnum():
+                    return True
+        return False
+
+
+def load_phrases(path=BANNED_PHRASES_FILE):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+# ----------------------------------------------------------------------
+# Stages: check() -> причина или None, record() — только для принятых
+# ----------------------------------------------------------------------
+
+class BannedPhraseStage:
+    def __init__(self, phrases=None):
+        self.matcher = PhraseMatcher(load_phrases() if phrases is None else phrases)
+
+    def check(self, sender, target, text, now):
+        if self.matcher and self.matcher.search(text):
+            return REASON_BANNED
+        return None
+
+    def record(self, sender, target, text, now):
+        pass
+
+
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 1000003
+
+
+def fingerprint(text, k=DUPLICATE_SHINGLE):
+    """Набор хэшей k-словных шинглов (полиномиальный rolling hash по словам)."""
+    words = text.split()
+    if len(words) <= k:
+        return frozenset([hash(text)])
+    top = pow(_HASH_BASE, k - 1, _HASH_MOD)
+    codes = [hash(w) % _HASH_MOD for w in words]
+    h = 0
+    for c in codes[:k]:
+        h = (h * _HASH_BASE + c) % _HASH_MOD
+    hashes = {h}
+    for old, new in zip(codes, codes[k:]):
+        h = ((h - old * top) * _HASH_BASE + new) % _HASH_MOD
+        hashes.add(h)
+    return frozenset(hashes)
+
+
+class DuplicateStage:
+    """Рассылка одного и того же текста разным получателям от одного отправителя.
+
+    Короткие сообщения («да», «ок», «спасибо») не проверяются, а повтор
+    одному и тому же получателю спамом не считается.
+    """
+
+    def __init__(self, max_senders=DUPLICATE_MAX_SENDERS):
+        self.max_senders = max_senders
+        self.recent = OrderedDict()  # sender -> deque[(ts, target, fingerprint)]
+        self._last = (None, None)    # check() и record() идут подряд — считаем один раз
+
+    def _fingerprint(self, text):
+        if self._last[0] != text:
+            self._last = (text, fingerprint(text))
+        return self._last[1]
+
+    @staticmethod
+    def _too_short(text):
+        # text уже нормализован — слова разделены ровно одним пробелом
+        return text.count(" ") < DUPLICATE_SHINGLE
+
+    def check(self, sender, target, text, now):
+        history = self.recent.get(sender)
+        if not history or self._too_short(text):
+            return None
+        self.recent.move_to_end(sender)
+        fp = self._fingerprint(text)
+        targets = set()
+        for ts, old_target, old in history:
+            if old_target == target or now - ts > DUPLICATE_WINDOW_SECONDS:
+                continue
+            if len(fp & old) >= DUPLICATE_THRESHOLD * len(fp | old):
+                targets.add(old_target)
+                if len(targets) + 1 >= DUPLICATE_MIN_TARGETS:
+                    return REASON_DUPLICATE
+        return None
+
+    def record(self, sender, target, text, now):
+        if self._too_short(text):
+            return
+        history = self.recent.get(sender)
+        if history is None:
+            history = self.recent[sender] = deque(maxlen=DUPLICATE_HISTORY)
+            if len(self.recent) > self.max_senders:
+                self.recent.popitem(last=False)
+        else:
+            self.recent.move_to_end(sender)
+        history.append((now, target, self._fingerprint(text)))
+
+
+class TargetFloodStage:
+    """Окно сообщений на получателя.
+
+    Один отправитель занимает в окне не больше FLOOD_SENDER_LIMIT мест,
+    поэтому в одиночку не может закрыть получателю входящие для всех.
+    """
+
+    def __init__(self, max_targets=FLOOD_MAX_TARGETS):
+        self.max_targets = max_targets
+        self.hits = OrderedDict()  # target -> deque[(ts, sender)]
+
+    def check(self, sender, target, text, now):
+        hits = self.hits.get(target)
+        if not hits:
+            return None
+        while hits and now - hits[0][0] > FLOOD_TARGET_WINDOW_SECONDS:
+            hits.popleft()
+        if len(hits) >= FLOOD_TARGET_LIMIT:
+            return REASON_FLOOD
+        if sum(1 for _, s in hits if s == sender) >= FLOOD_SENDER_LIMIT:
+            return REASON_FLOOD
+        return None
+
+    def record(self, sender, target, text, now):
+        hits = self.hits.get(target)
+        if hits is None:
+            hits = self.hits[target] = deque(maxlen=FLOOD_TARGET_LIMIT)
+            if len(self.hits) > self.max_targets:
+                self.hits.popitem(last=False)
+        else:
+            self.hits.move_to_end(target)
+        hits.append((now, sender))
+
+
+# ----------------------------------------------------------------------
+
+class SpamFilter:
+    def __init__(self, stages=None):
+        if stages is None:
+            stages = [BannedPhraseStage(), TargetFloodStage(), DuplicateStage()]
+        self.stages = list(stages)
+
+    def check(self, sender, target, text):
+        """Возвращает причину отказа или None; принятое сообщение запоминается."""
+        now = time.monotonic()
+        text = normalize(text)
+        for stage in self.stages:
+            reason = stage.check(sender, target, text, now)
+            if reason:
+                return reason
+        for stage in self.stages:
+            stage.record(sender, target, text, now)
+        return None